@@ -1,18 +1,64 @@
 import streamlit as st
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import folium
-from streamlit_folium import st_folium
+import streamlit.components.v1 as components
 from folium.plugins import HeatMap
 import numpy as np
-import random
-from fpdf import FPDF
 import altair as alt
-import matplotlib.pyplot as plt
-import seaborn as sns
 import tempfile
 import os
+import io
+import json
+try:
+    import orjson
+except ImportError:
+    import json as orjson
 import datetime
+import html
+import threading
+import time
+from engines import calc_roi
+
+# Theme stylesheets are fixed literals with no per-rerun interpolation. Only the colour
+# rules differ between modes; the shared layout rules live in _BASE_CSS.
+_BASE_CSS = """
+    .metric-box {
+        border-radius: 8px;
+        padding: 15px; text-align: center; transition: transform 0.2s;
+        box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.1); height: 100%;
+    }
+    .metric-box:hover { transform: translateY(-5px); border-color: #3b82f6; }
+    .metric-lbl { color: #94a3b8; font-size: 11px; font-weight: 700; text-transform: uppercase; letter-spacing: 0.5px; }
+    .metric-val { font-size: 22px; font-weight: 800; margin: 5px 0; }
+    .metric-desc { font-size: 10px; color: #64748b; line-height: 1.2; }
+    .sub-pos { color: #16a34a; font-weight: bold; font-size: 11px; }
+    .sub-neg { color: #dc2626; font-weight: bold; font-size: 11px; }
+"""
+
+_DARK_CSS = """
+    <style>
+    .stApp { background-color: #0e1117; color: white; }
+    .stTextInput>div>div>input, .stNumberInput>div>div>input, .stSelectbox>div>div>div { 
+        background-color: #000000; color: white; border: 1px solid #334155; 
+    }
+    .metric-box { background: #1e293b; border: 1px solid #334155; }
+    .metric-val { color: white; }
+""" + _BASE_CSS + """    </style>
+"""
+
+_LIGHT_CSS = """
+    <style>
+    .stApp { background-color: #f8fafc; color: #0f172a; }
+    .stTextInput>div>div>input, .stNumberInput>div>div>input, .stSelectbox>div>div>div { 
+        background-color: #ffffff; color: #0f172a; border: 1px solid #e2e8f0; 
+    }
+    .metric-box { background: #ffffff; border: 1px solid #e2e8f0; }
+    .metric-val { color: #0f172a; }
+""" + _BASE_CSS + """    </style>
+"""
 
 # --- 1. PAGE CONFIGURATION ---
 st.set_page_config(
@@ -27,177 +73,220 @@ with st.sidebar:
     st.title("🎛️ Control Room")
     is_dark_mode = st.toggle("🌙 Dark Mode", value=True)
 
-if is_dark_mode:
-    bg_color, text_color, card_bg, card_border = "#0e1117", "white", "#1e293b", "#334155"
-    input_bg, map_tiles, chart_theme = "#000000", "cartodb dark_matter", "dark_background"
-else:
-    bg_color, text_color, card_bg, card_border = "#f8fafc", "#0f172a", "#ffffff", "#e2e8f0"
-    input_bg, map_tiles, chart_theme = "#ffffff", "cartodbpositron", "default"
+map_tiles, chart_theme = ("cartodb dark_matter", "dark_background") if is_dark_mode else ("cartodbpositron", "default")
 
-st.markdown(f"""
-    <style>
-    .stApp {{ background-color: {bg_color}; color: {text_color}; }}
-    .stTextInput>div>div>input, .stNumberInput>div>div>input, .stSelectbox>div>div>div {{ 
-        background-color: {input_bg}; color: {text_color}; border: 1px solid {card_border}; 
-    }}
-    .metric-box {{
-        background: {card_bg}; border: 1px solid {card_border}; border-radius: 8px;
-        padding: 15px; text-align: center; transition: transform 0.2s;
-        box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.1); height: 100%;
-    }}
-    .metric-box:hover {{ transform: translateY(-5px); border-color: #3b82f6; }}
-    .metric-lbl {{ color: #94a3b8; font-size: 11px; font-weight: 700; text-transform: uppercase; letter-spacing: 0.5px; }}
-    .metric-val {{ color: {text_color}; font-size: 22px; font-weight: 800; margin: 5px 0; }}
-    .metric-desc {{ font-size: 10px; color: #64748b; line-height: 1.2; }}
-    .sub-pos {{ color: #16a34a; font-weight: bold; font-size: 11px; }}
-    .sub-neg {{ color: #dc2626; font-weight: bold; font-size: 11px; }}
-    </style>
-""", unsafe_allow_html=True)
+st.markdown(_DARK_CSS if is_dark_mode else _LIGHT_CSS, unsafe_allow_html=True)
 
 if 'analysis_active' not in st.session_state: st.session_state['analysis_active'] = False
 
 # --- 3. INTELLIGENCE ENGINES ---
+_GEO_TTL, _GEO_MAX = 86400, 500  # seconds an entry stays fresh; entries kept on disk
+
+def _geo_entry_ok(v):
+    return (isinstance(v, list) and len(v) == 4 and isinstance(v[2], str)
+            and all(isinstance(x, (int, float)) for x in (v[0], v[1], v[3])))
+
+@st.cache_resource
+def _geo_store():
+    # Disk-backed geocode results shared across sessions and restarts; the lock guards the dict and the file
+    path = os.path.join(tempfile.gettempdir(), 'sitescout_geocache.json')
+    try:
+        with open(path) as f: store = json.load(f)
+    except (OSError, ValueError): store = {}
+    if not isinstance(store, dict): store = {}
+    store = {k: v for k, v in store.items() if _geo_entry_ok(v)}
+    return path, store, threading.Lock()
+
+def _save_geo_store(path, store):
+    # Keep the newest _GEO_MAX entries, then write to a sibling temp file and swap it in
+    # so readers never see a partial file
+    if len(store) > _GEO_MAX:
+        for k in sorted(store, key=lambda k: store[k][3])[:len(store) - _GEO_MAX]: del store[k]
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.json')
+        with os.fdopen(fd, 'w') as f: json.dump(store, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+@st.cache_resource
+def _http():
+    # Pooled keep-alive session so repeat geocodes skip the TCP/TLS handshake
+    s = requests.Session()
+    s.headers.update({'User-Agent': 'SiteScout_V33/1.0'})
+    s.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=Retry(total=2, backoff_factor=0.3)))
+    return s
+
 class LocationEngine:
-    def __init__(self): self.headers = {'User-Agent': 'SiteScout_V33/1.0'}
-    
     def get_coords(self, query):
-        try:
-            r = requests.get("https://nominatim.openstreetmap.org/search", 
-                           params={'q': query, 'format': 'json', 'limit': 1}, 
-                           headers=self.headers, timeout=5)
-            if r.status_code == 200 and len(r.json()) > 0:
-                d = r.json()[0]
-                return float(d['lat']), float(d['lon']), d['display_name']
-        except: pass
-        return None, None, None
+        try: return self._geocode(query.strip().lower())
+        except Exception: return None, None, None
+
+    @st.cache_data(ttl=_GEO_TTL, show_spinner=False)
+    def _geocode(_self, query):
+        # Raises on any failure so misses are not cached and are retried on the next run
+        path, store, lock = _geo_store()
+        with lock: hit = store.get(query)
+        if hit and time.time() - hit[3] < _GEO_TTL: return tuple(hit[:3])
+        r = _http().get("https://nominatim.openstreetmap.org/search", 
+                        params={'q': query, 'format': 'json', 'limit': 1}, timeout=5)
+        r.raise_for_status()
+        d = orjson.loads(r.content)[0]
+        coords = (float(d['lat']), float(d['lon']), d['display_name'])
+        with lock:
+            store[query] = [*coords, time.time()]
+            _save_geo_store(path, store)
+        return coords
 
     @st.cache_data(ttl=3600)
     def fetch_market_data(_self, lat, lon):
-        data = []
-        for _ in range(30): data.append({"Category": "Competitor", "Lat": lat + random.gauss(0, 0.005), "Lon": lon + random.gauss(0, 0.005), "Name": f"Rival {random.choice(['Cafe', 'Grill', 'Bistro'])}"})
-        for _ in range(50): data.append({"Category": "Corporate", "Lat": lat + random.gauss(0, 0.004), "Lon": lon + random.gauss(0, 0.004), "Name": "Office Block"})
-        return pd.DataFrame(data)
+        # Seeded per location so the same site always simulates the same catchment
+        rng = np.random.default_rng(abs(hash((round(lat, 4), round(lon, 4)))) & 0xFFFFFFFF)
+        comp = rng.normal([lat, lon], 0.005, (30, 2))
+        corp = rng.normal([lat, lon], 0.004, (50, 2))
+        coords = np.vstack([comp, corp])
+        names = np.concatenate([np.char.add("Rival ", rng.choice(['Cafe', 'Grill', 'Bistro'], 30)), np.full(50, "Office Block")])
+        return pd.DataFrame({"Category": np.repeat(["Competitor", "Corporate"], [30, 50]), "Lat": coords[:, 0], "Lon": coords[:, 1], "Name": names})
 
 class FinancialEngine:
     def calculate_roi(self, area, rent, capex, ticket, orders, staff_cost, cogs_pct):
-        monthly_rev = orders * ticket * 30
-        monthly_rent = area * rent
-        monthly_cogs = monthly_rev * (cogs_pct / 100)
-        monthly_opex = monthly_rent + staff_cost + (monthly_rev * 0.05)
-        
-        net_profit = monthly_rev - monthly_cogs - monthly_opex
-        margin = (net_profit / monthly_rev) * 100 if monthly_rev > 0 else 0
-        breakeven = capex / net_profit if net_profit > 0 else 999
-        rent_coverage = monthly_rev / monthly_rent if monthly_rent > 0 else 0
-        opex_ratio = (monthly_opex / monthly_rev) * 100 if monthly_rev > 0 else 0
-        coc_return = (net_profit * 12) / capex * 100 if capex > 0 else 0 # Annualized Cash on Cash
-        
-        return {
-            "rev": monthly_rev, "profit": net_profit, "margin": margin, 
-            "breakeven": breakeven, "rent_cov": rent_coverage, "opex_ratio": opex_ratio, "coc": coc_return,
-            "costs": {"Rent": monthly_rent, "COGS": monthly_cogs, "Staff": staff_cost, "Misc": monthly_rev*0.05}
-        }
+        res = calc_roi(area, rent, capex, ticket, orders, staff_cost, cogs_pct)._asdict()
+        res['costs'] = dict(res['costs'])
+        return res
 
 # --- 4. 3-PAGE PDF GENERATOR ---
-def create_investor_deck(addr, fin_data, projections, input_metrics):
-    temp_dir = tempfile.gettempdir()
-    plt.style.use('default') 
-    
+# Chart figures are built once, on the first dossier request, and redrawn per report; the
+# lock keeps concurrent sessions from drawing onto the same axes at the same time.
+# matplotlib (here) and fpdf (in create_investor_deck) are imported lazily because both
+# only run after the user clicks "Prepare Dossier".
+@st.cache_resource
+def _chart_figures():
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    roi_fig = Figure(figsize=(7, 4)); FigureCanvasAgg(roi_fig)
+    cost_fig = Figure(figsize=(5, 5)); FigureCanvasAgg(cost_fig)
+    return roi_fig, roi_fig.add_subplot(111), cost_fig, cost_fig.add_subplot(111), threading.Lock()
+
+@st.cache_data(ttl=600, show_spinner=False)
+def create_investor_deck(addr, capex, rev, profit, margin, breakeven, rent_cov, opex_ratio, coc, cogs, rent_cost, staff, misc, orders):
+    from fpdf import FPDF, XPos, YPos
+    roi_fig, roi_ax, cost_fig, cost_ax, chart_lock = _chart_figures()
+
     # Chart 1: ROI
-    plt.figure(figsize=(7, 4))
-    months = list(range(1, 37))
-    cashflow = [-fin_data['costs']['Rent'] * 6] + [-input_metrics['capex'] + (fin_data['profit'] * m) for m in months] # Simple simulation
-    cashflow = cashflow[:24] # Keep 24 months
-    plt.plot(range(1, 25), cashflow, color='#16a34a', linewidth=2)
-    plt.axhline(y=0, color='black', linestyle='--', alpha=0.5)
-    plt.title("24-Month Cashflow Projection")
-    plt.xlabel("Month"); plt.ylabel("Net Cash Position (INR)")
-    plt.grid(True, alpha=0.2)
-    plt.savefig(os.path.join(temp_dir, 'roi_chart.png'), dpi=100, bbox_inches='tight'); plt.close()
-
-    # Chart 2: Cost Breakdown Pie
-    plt.figure(figsize=(5, 5))
-    costs = fin_data['costs']
-    plt.pie(costs.values(), labels=costs.keys(), autopct='%1.1f%%', colors=['#f87171', '#fbbf24', '#60a5fa', '#94a3b8'])
-    plt.title("Operational Expense Split")
-    plt.savefig(os.path.join(temp_dir, 'cost_chart.png'), dpi=100, bbox_inches='tight'); plt.close()
+    months = np.arange(1, 25)
+    cashflow = profit * months - capex # Simple simulation
+    roi_buf, cost_buf = io.BytesIO(), io.BytesIO()
+    with chart_lock:
+        roi_ax.clear()
+        roi_ax.plot(months, cashflow, color='#16a34a', linewidth=2)
+        roi_ax.axhline(y=0, color='black', linestyle='--', alpha=0.5)
+        roi_ax.set_title("24-Month Cashflow Projection")
+        roi_ax.set_xlabel("Month"); roi_ax.set_ylabel("Net Cash Position (INR)")
+        roi_ax.grid(True, alpha=0.2)
+        roi_fig.savefig(roi_buf, format='png', dpi=100, bbox_inches='tight')
+
+        # Chart 2: Cost Breakdown Pie
+        costs = {"Rent": rent_cost, "COGS": cogs, "Staff": staff, "Misc": misc}
+        cost_ax.clear()
+        cost_ax.pie(list(costs.values()), labels=list(costs.keys()), autopct='%1.1f%%', colors=['#f87171', '#fbbf24', '#60a5fa', '#94a3b8'])
+        cost_ax.set_title("Operational Expense Split")
+        cost_fig.savefig(cost_buf, format='png', dpi=100, bbox_inches='tight')
+    roi_buf.seek(0); cost_buf.seek(0)
 
     class PDF(FPDF):
         def header(self):
-            self.set_font('Arial', 'B', 10)
+            self.set_font('Helvetica', 'B', 10)
             self.set_text_color(128)
-            self.cell(0, 10, f'INVESTMENT MEMORANDUM: {addr.split(",")[0].upper()}', 0, 1, 'R')
+            self.cell(0, 10, f'INVESTMENT MEMORANDUM: {addr.split(",")[0].upper()}', border=0, new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='R')
             self.ln(2)
         def footer(self):
-            self.set_y(-15); self.set_font('Arial', 'I', 8)
-            self.cell(0, 10, f'Page {self.page_no()} | Generated by SiteScout AI', 0, 0, 'C')
+            self.set_y(-15); self.set_font('Helvetica', 'I', 8)
+            self.cell(0, 10, f'Page {self.page_no()} | Generated by SiteScout AI', border=0, new_x=XPos.RIGHT, new_y=YPos.TOP, align='C')
 
     pdf = PDF()
     
     # --- PAGE 1: EXECUTIVE SUMMARY ---
     pdf.add_page()
     pdf.set_text_color(0)
-    pdf.set_font('Arial', 'B', 24); pdf.cell(0, 15, "Site Investment Dossier", 0, 1)
-    pdf.set_font('Arial', '', 12); pdf.cell(0, 10, f"Date: {datetime.date.today().strftime('%B %d, %Y')}", 0, 1)
+    pdf.set_font('Helvetica', 'B', 24); pdf.cell(0, 15, "Site Investment Dossier", border=0, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.set_font('Helvetica', '', 12); pdf.cell(0, 10, f"Date: {datetime.date.today().strftime('%B %d, %Y')}", border=0, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
     pdf.ln(5)
     
-    pdf.set_font('Arial', 'B', 14); pdf.set_fill_color(240, 240, 240); pdf.cell(0, 10, "  1. Executive Verdict", 0, 1, 'L', True)
+    pdf.set_font('Helvetica', 'B', 14); pdf.set_fill_color(240, 240, 240); pdf.cell(0, 10, "  1. Executive Verdict", border=0, new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='L', fill=True)
     pdf.ln(5)
-    pdf.set_font('Arial', '', 11)
+    pdf.set_font('Helvetica', '', 11)
     
-    verdict = "Strong Buy" if fin_data['rent_cov'] > 4 else ("Cautious Hold" if fin_data['rent_cov'] > 2 else "High Risk")
+    verdict = "Strong Buy" if rent_cov > 4 else ("Cautious Hold" if rent_cov > 2 else "High Risk")
     summary = (f"The proposed site in {addr.split(',')[0]} demonstrates a '{verdict}' signal based on current market assumptions. "
-               f"With a capital injection of INR {input_metrics['capex']:,}, the model projects a Break-Even point of {fin_data['breakeven']:.1f} months. "
-               f"The location is capable of generating INR {fin_data['rev']/100000:.1f} Lakhs in monthly revenue at {projections['orders']} daily orders.")
+               f"With a capital injection of INR {capex:,}, the model projects a Break-Even point of {breakeven:.1f} months. "
+               f"The location is capable of generating INR {rev/100000:.1f} Lakhs in monthly revenue at {orders} daily orders.")
     pdf.multi_cell(0, 7, summary)
     pdf.ln(10)
     
-    pdf.image(os.path.join(temp_dir, 'roi_chart.png'), x=15, w=180)
+    pdf.image(roi_buf, x=15, w=180)
 
     # --- PAGE 2: FINANCIAL DEEP DIVE ---
     pdf.add_page()
-    pdf.set_font('Arial', 'B', 14); pdf.cell(0, 10, "  2. Financial Deep Dive", 0, 1, 'L', True)
+    pdf.set_font('Helvetica', 'B', 14); pdf.cell(0, 10, "  2. Financial Deep Dive", border=0, new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='L', fill=True)
     pdf.ln(10)
     
     # Table Header
-    pdf.set_font('Arial', 'B', 11); pdf.set_fill_color(220, 220, 220)
-    pdf.cell(100, 10, "Metric", 1, 0, 'L', True); pdf.cell(60, 10, "Projected Value", 1, 1, 'L', True)
+    pdf.set_font('Helvetica', 'B', 11); pdf.set_fill_color(220, 220, 220)
+    pdf.cell(100, 10, "Metric", border=1, new_x=XPos.RIGHT, new_y=YPos.TOP, align='L', fill=True); pdf.cell(60, 10, "Projected Value", border=1, new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='L', fill=True)
     
     # Table Rows
-    pdf.set_font('Arial', '', 11)
+    pdf.set_font('Helvetica', '', 11)
     metrics = [
-        ("Monthly Revenue", f"INR {fin_data['rev']:,.0f}"),
-        ("Monthly Rent", f"INR {fin_data['costs']['Rent']:,.0f}"),
-        ("Staff & Overheads", f"INR {(fin_data['costs']['Staff'] + fin_data['costs']['Misc']):,.0f}"),
-        ("Net Profit (EBITDA)", f"INR {fin_data['profit']:,.0f}"),
-        ("Net Margin %", f"{fin_data['margin']:.1f}%"),
-        ("Cash-on-Cash Return (Year 1)", f"{fin_data['coc']:.1f}%")
+        ("Monthly Revenue", f"INR {rev:,.0f}"),
+        ("Monthly Rent", f"INR {rent_cost:,.0f}"),
+        ("Staff & Overheads", f"INR {(staff + misc):,.0f}"),
+        ("Net Profit (EBITDA)", f"INR {profit:,.0f}"),
+        ("Net Margin %", f"{margin:.1f}%"),
+        ("Cash-on-Cash Return (Year 1)", f"{coc:.1f}%")
     ]
     for m, v in metrics:
-        pdf.cell(100, 10, m, 1); pdf.cell(60, 10, v, 1, 1)
+        pdf.cell(100, 10, m, border=1); pdf.cell(60, 10, v, border=1, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         
     pdf.ln(10)
-    pdf.image(os.path.join(temp_dir, 'cost_chart.png'), x=60, w=90)
+    pdf.image(cost_buf, x=60, w=90)
 
     # --- PAGE 3: STRATEGIC GLOSSARY ---
     pdf.add_page()
-    pdf.set_font('Arial', 'B', 14); pdf.cell(0, 10, "  3. Strategic KPI Glossary", 0, 1, 'L', True)
+    pdf.set_font('Helvetica', 'B', 14); pdf.cell(0, 10, "  3. Strategic KPI Glossary", border=0, new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='L', fill=True)
     pdf.ln(5)
-    pdf.set_font('Arial', '', 10)
     
     definitions = [
-        ("Rent Coverage Ratio", f"{fin_data['rent_cov']:.2f}x", "Revenue divided by Rent. Ideally > 4x. Shows how easily sales cover the lease."),
-        ("OpEx Ratio", f"{fin_data['opex_ratio']:.1f}%", "Operating Expenses as % of Revenue. Lower is better (Efficiency)."),
-        ("Break-Even Point", f"{fin_data['breakeven']:.1f} Mo", "Months required to recover the initial CAPEX from Net Profits."),
-        ("Cash-on-Cash Return", f"{fin_data['coc']:.1f}%", "Annual Net Profit divided by Total Cash Invested. >20% is excellent.")
+        ("Rent Coverage Ratio", f"{rent_cov:.2f}x", "Revenue divided by Rent. Ideally > 4x. Shows how easily sales cover the lease."),
+        ("OpEx Ratio", f"{opex_ratio:.1f}%", "Operating Expenses as % of Revenue. Lower is better (Efficiency)."),
+        ("Break-Even Point", f"{breakeven:.1f} Mo", "Months required to recover the initial CAPEX from Net Profits."),
+        ("Cash-on-Cash Return", f"{coc:.1f}%", "Annual Net Profit divided by Total Cash Invested. >20% is excellent.")
     ]
     
-    for title, val, desc in definitions:
-        pdf.set_font('Arial', 'B', 11); pdf.cell(60, 8, title, 0, 0)
-        pdf.set_text_color(22, 163, 74); pdf.cell(30, 8, val, 0, 0)
-        pdf.set_text_color(0); pdf.set_font('Arial', '', 10); pdf.multi_cell(0, 8, desc); pdf.ln(3)
+    # One write_html call lays out the whole glossary instead of a cell per field
+    pdf.write_html('<font face="helvetica" size="10">' + ''.join(
+        f'<p><b>{html.escape(title)}</b> &nbsp; <font color="#16a34a">{html.escape(val)}</font><br>{html.escape(desc)}</p>'
+        for title, val, desc in definitions) + '</font>')
+
+    return bytes(pdf.output())
+
+# Each metric row is injected as one grid block of cards rendered from a fixed template
+_GRID_OPEN = '<div style="display:grid;grid-template-columns:repeat(4,1fr);gap:16px">'
+_CARD_TPL = '<div class="metric-box"><div class="metric-lbl">{lbl}</div><div class="metric-val">{val}</div><div class="metric-desc {sub}">{desc}</div></div>'
+
+# P&L chart spec is fixed; only the bar values change per analysis. Built once per
+# server on first use, since module-level objects are rebuilt on every rerun.
+_PNL_ITEMS, _PNL_TYPES = ('Revenue', 'COGS', 'Rent', 'Staff', 'Net Profit'), ('Inc', 'Exp', 'Exp', 'Exp', 'Tot')
+
+@st.cache_resource
+def _chart_base():
+    return alt.Chart().mark_bar().encode(x=alt.X('Item:N', sort=None), y='Amount:Q', color=alt.Color('Type:N', scale=alt.Scale(domain=['Inc', 'Exp', 'Tot'], range=['#4ade80', '#f87171', '#fbbf24']))).properties(height=400)
 
-    return pdf.output(dest='S').encode('latin-1')
+# The map has no click handlers, so a static HTML snapshot avoids st_folium's two-way sync
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
+def _render_map(lat, lon, corp_coords_bytes, tiles):
+    m = folium.Map([lat, lon], zoom_start=15, tiles=tiles)
+    HeatMap(np.frombuffer(corp_coords_bytes).reshape(-1, 2).tolist(), gradient={0.4: '#3b82f6', 1: '#60a5fa'}, radius=15).add_to(m)
+    return m.get_root().render()
 
 # --- 5. MAIN LOGIC ---
 loc_engine = LocationEngine()
@@ -228,55 +317,74 @@ with st.sidebar:
         st.rerun()
     if st.button("🔄 Reset", use_container_width=True):
         st.session_state['analysis_active'] = False
+        for k in ('cached_result', 'last_inputs', 'dossier_inputs'): st.session_state.pop(k, None)
         st.rerun()
 
 # --- DASHBOARD UI ---
 if st.session_state['analysis_active']:
-    lat, lon, addr = loc_engine.get_coords(final_loc)
+    # Cosmetic reruns (e.g. the theme toggle) reuse the last analysis instead of recomputing it
+    inputs = (final_loc, area, rent, capex, ticket, orders)
+    res = st.session_state.get('cached_result') if st.session_state.get('last_inputs') == inputs else None
+    if res is None:
+        lat, lon, addr = loc_engine.get_coords(final_loc)
+        res = {'lat': lat, 'lon': lon, 'addr': addr}
+        if lat:
+            df = loc_engine.fetch_market_data(lat, lon)
+            res['counts'] = df['Category'].value_counts().to_dict()
+            res['corp_coords'] = df.loc[df['Category'] == 'Corporate', ['Lat', 'Lon']].to_numpy()
+            res['fin'] = fin_engine.calculate_roi(area, rent, capex, ticket, orders, 150000, 30)
+            # Only successful lookups are kept, so a failed geocode is retried on the next run
+            st.session_state['cached_result'], st.session_state['last_inputs'] = res, inputs
+    lat, lon, addr = res['lat'], res['lon'], res['addr']
     
     if lat:
-        df = loc_engine.fetch_market_data(lat, lon)
-        fin = fin_engine.calculate_roi(area, rent, capex, ticket, orders, 150000, 30)
+        counts, corp_coords, fin = res['counts'], res['corp_coords'], res['fin']
         
         st.title(f"Investment Report: {addr.split(',')[0]}")
         st.markdown("---")
         
         # ROW 1: PRIMARY FINANCIALS
-        c1, c2, c3, c4 = st.columns(4)
-        c1.markdown(f"""<div class="metric-box"><div class="metric-lbl">Monthly Revenue</div><div class="metric-val">₹{fin['rev']:,.0f}</div><div class="metric-desc">@ {orders} orders/day</div></div>""", unsafe_allow_html=True)
-        c2.markdown(f"""<div class="metric-box"><div class="metric-lbl">Take Home Cash</div><div class="metric-val">₹{fin['profit']:,.0f}</div><div class="metric-desc sub-pos">{fin['margin']:.1f}% Margin</div></div>""", unsafe_allow_html=True)
-        c3.markdown(f"""<div class="metric-box"><div class="metric-lbl">Payback Period</div><div class="metric-val">{fin['breakeven']:.1f}</div><div class="metric-desc">Months to Break-Even</div></div>""", unsafe_allow_html=True)
-        c4.markdown(f"""<div class="metric-box"><div class="metric-lbl">Rent Coverage</div><div class="metric-val">{fin['rent_cov']:.1f}x</div><div class="metric-desc">Safety Factor</div></div>""", unsafe_allow_html=True)
+        cards = [
+            dict(lbl="Monthly Revenue", val=f"₹{fin['rev']:,.0f}", sub="", desc=f"@ {orders} orders/day"),
+            dict(lbl="Take Home Cash", val=f"₹{fin['profit']:,.0f}", sub="sub-pos", desc=f"{fin['margin']:.1f}% Margin"),
+            dict(lbl="Payback Period", val=f"{fin['breakeven']:.1f}", sub="", desc="Months to Break-Even"),
+            dict(lbl="Rent Coverage", val=f"{fin['rent_cov']:.1f}x", sub="", desc="Safety Factor"),
+        ]
+        st.markdown(_GRID_OPEN + ''.join(_CARD_TPL.format(**c) for c in cards) + "</div>", unsafe_allow_html=True)
         st.markdown("###")
 
         # ROW 2: SECONDARY METRICS (8 Scorecards Total)
-        c5, c6, c7, c8 = st.columns(4)
-        c5.markdown(f"""<div class="metric-box"><div class="metric-lbl">OpEx Ratio</div><div class="metric-val">{fin['opex_ratio']:.1f}%</div><div class="metric-desc">Efficiency Score</div></div>""", unsafe_allow_html=True)
-        c6.markdown(f"""<div class="metric-box"><div class="metric-lbl">Cash-on-Cash</div><div class="metric-val">{fin['coc']:.1f}%</div><div class="metric-desc">Annual Return</div></div>""", unsafe_allow_html=True)
-        c7.markdown(f"""<div class="metric-box"><div class="metric-lbl">Rival Count</div><div class="metric-val">{len(df[df['Category']=='Competitor'])}</div><div class="metric-desc">Direct Competitors</div></div>""", unsafe_allow_html=True)
-        c8.markdown(f"""<div class="metric-box"><div class="metric-lbl">Demand Hubs</div><div class="metric-val">{len(df[df['Category']=='Corporate'])}</div><div class="metric-desc">Offices Nearby</div></div>""", unsafe_allow_html=True)
+        cards = [
+            dict(lbl="OpEx Ratio", val=f"{fin['opex_ratio']:.1f}%", sub="", desc="Efficiency Score"),
+            dict(lbl="Cash-on-Cash", val=f"{fin['coc']:.1f}%", sub="", desc="Annual Return"),
+            dict(lbl="Rival Count", val=counts.get('Competitor', 0), sub="", desc="Direct Competitors"),
+            dict(lbl="Demand Hubs", val=counts.get('Corporate', 0), sub="", desc="Offices Nearby"),
+        ]
+        st.markdown(_GRID_OPEN + ''.join(_CARD_TPL.format(**c) for c in cards) + "</div>", unsafe_allow_html=True)
         st.markdown("###")
 
         # ROW 3: CHARTS
         col_viz1, col_viz2 = st.columns([1.5, 1])
         with col_viz1:
             st.subheader("📍 Catchment Analysis")
-            m = folium.Map([lat, lon], zoom_start=15, tiles=map_tiles)
-            HeatMap([[r['Lat'], r['Lon']] for i, r in df[df['Category']=='Corporate'].iterrows()], gradient={0.4: '#3b82f6', 1: '#60a5fa'}, radius=15).add_to(m)
-            st_folium(m, height=400, width=None)
+            components.html(_render_map(lat, lon, corp_coords.tobytes(), map_tiles), height=400)
         with col_viz2:
             st.subheader("📉 P&L Waterfall")
-            cost_data = pd.DataFrame({'Item': ['Revenue', 'COGS', 'Rent', 'Staff', 'Net Profit'], 'Amount': [fin['rev'], -fin['costs']['COGS'], -fin['costs']['Rent'], -fin['costs']['Staff'], fin['profit']], 'Type': ['Inc', 'Exp', 'Exp', 'Exp', 'Tot']})
-            chart = alt.Chart(cost_data).mark_bar().encode(x=alt.X('Item', sort=None), y='Amount', color=alt.Color('Type', scale=alt.Scale(domain=['Inc', 'Exp', 'Tot'], range=['#4ade80', '#f87171', '#fbbf24']))).properties(height=400)
-            st.altair_chart(chart, use_container_width=True)
+            values = [{'Item': item, 'Amount': amt, 'Type': typ} for item, amt, typ in zip(_PNL_ITEMS, (fin['rev'], -fin['costs']['COGS'], -fin['costs']['Rent'], -fin['costs']['Staff'], fin['profit']), _PNL_TYPES)]
+            st.altair_chart(_chart_base().properties(data=alt.Data(values=values)), use_container_width=True)
 
         st.markdown("---")
         # DOWNLOAD SECTION
         c_final1, c_final2 = st.columns([3, 1])
-        c_final1.info(f"**Strategic Verdict:** To cover your rent of ₹{fin['costs']['Rent']:,.0f}, you need to sell **{int(fin['costs']['Rent']/(ticket*0.3))} units** monthly. Ensure your marketing plan targets the {len(df[df['Category']=='Corporate'])} corporate offices nearby.")
+        c_final1.info(f"**Strategic Verdict:** To cover your rent of ₹{fin['costs']['Rent']:,.0f}, you need to sell **{int(fin['costs']['Rent']/(ticket*0.3))} units** monthly. Ensure your marketing plan targets the {counts.get('Corporate', 0)} corporate offices nearby.")
         
-        pdf_bytes = create_investor_deck(addr, fin, {'orders':orders}, {'capex':capex})
-        c_final2.download_button("📥 Download 3-Page Dossier", data=pdf_bytes, file_name=f"SiteScout_Dossier_{addr.split(',')[0]}.pdf", mime="application/pdf", type="primary", use_container_width=True)
+        # The dossier is only built once requested for the current inputs, so plain dashboard renders skip matplotlib/fpdf
+        if c_final2.button("📄 Prepare Dossier", use_container_width=True):
+            st.session_state['dossier_inputs'] = inputs
+        if st.session_state.get('dossier_inputs') == inputs:
+            pdf_bytes = create_investor_deck(addr, capex, fin['rev'], fin['profit'], fin['margin'], fin['breakeven'], fin['rent_cov'], fin['opex_ratio'], fin['coc'],
+                                             fin['costs']['COGS'], fin['costs']['Rent'], fin['costs']['Staff'], fin['costs']['Misc'], orders)
+            c_final2.download_button("📥 Download 3-Page Dossier", data=pdf_bytes, file_name=f"SiteScout_Dossier_{addr.split(',')[0]}.pdf", mime="application/pdf", type="primary", use_container_width=True)
 
     else:
         st.error("Location not found. Please try a different query.")
@@ -286,6 +394,6 @@ else:
     st.markdown("### 🚀 Enterprise Site Selection Engine")
     st.info("👈 **Start by selecting a City and configuring your Financial Model in the Sidebar.**")
     cols = st.columns(3)
-    cols[0].markdown(f"""<div class="metric-box"><div class="metric-lbl">Max Investment</div><div class="metric-val">₹50 Cr</div></div>""", unsafe_allow_html=True)
-    cols[1].markdown(f"""<div class="metric-box"><div class="metric-lbl">Max Area</div><div class="metric-val">10k Sqft</div></div>""", unsafe_allow_html=True)
-    cols[2].markdown(f"""<div class="metric-box"><div class="metric-lbl">Status</div><div class="metric-val" style="color:#16a34a">ONLINE</div></div>""", unsafe_allow_html=True)
+    cols[0].markdown("""<div class="metric-box"><div class="metric-lbl">Max Investment</div><div class="metric-val">₹50 Cr</div></div>""", unsafe_allow_html=True)
+    cols[1].markdown("""<div class="metric-box"><div class="metric-lbl">Max Area</div><div class="metric-val">10k Sqft</div></div>""", unsafe_allow_html=True)
+    cols[2].markdown("""<div class="metric-box"><div class="metric-lbl">Status</div><div class="metric-val" style="color:#16a34a">ONLINE</div></div>""", unsafe_allow_html=True)
@@ -0,0 +1,24 @@
+# Pure financial model. Kept out of app.py because Streamlit re-executes the
+# script on every rerun, while imported modules (and their caches) persist.
+from collections import namedtuple
+from functools import lru_cache
+
+ROIResult = namedtuple('ROIResult', ['rev', 'profit', 'margin', 'breakeven', 'rent_cov', 'opex_ratio', 'coc', 'costs'])
+
+@lru_cache(maxsize=256)
+def calc_roi(area, rent, capex, ticket, orders, staff_cost, cogs_pct):
+    monthly_rev = orders * ticket * 30
+    monthly_rent = area * rent
+    monthly_cogs = monthly_rev * (cogs_pct / 100)
+    monthly_misc = monthly_rev * 0.05
+    monthly_opex = monthly_rent + staff_cost + monthly_misc
+    
+    net_profit = monthly_rev - monthly_cogs - monthly_opex
+    margin = (net_profit / monthly_rev) * 100 if monthly_rev > 0 else 0
+    breakeven = capex / net_profit if net_profit > 0 else 999
+    rent_coverage = monthly_rev / monthly_rent if monthly_rent > 0 else 0
+    opex_ratio = (monthly_opex / monthly_rev) * 100 if monthly_rev > 0 else 0
+    coc_return = (net_profit * 12) / capex * 100 if capex > 0 else 0 # Annualized Cash on Cash
+    
+    return ROIResult(monthly_rev, net_profit, margin, breakeven, rent_coverage, opex_ratio, coc_return,
+                     (("Rent", monthly_rent), ("COGS", monthly_cogs), ("Staff", staff_cost), ("Misc", monthly_misc)))